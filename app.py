@@ -1,6 +1,15 @@
 import streamlit as st
 import pandas as pd
 import io
+import re
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import xlsxwriter
+from concurrent.futures import ThreadPoolExecutor
+
+# Transaction types that get a short label in the Description column
+LABEL_PATTERN = re.compile(r'(SUBSCR|REDEMP)', re.IGNORECASE)
 
 st.set_page_config(page_title="Materai TXT to Excel Tool", layout="wide")
 
@@ -23,83 +32,191 @@ if 'display_df' not in st.session_state:
 if 'combined_df' not in st.session_state:
     st.session_state.combined_df = None
 
-if uploaded_txt_files and process_button:
-    st.info("Processing files... Please wait.")
-
-    combined_df = pd.concat([
-        pd.read_csv(file, delimiter='|', encoding='utf-8').assign(source_file=file.name)
-        for file in uploaded_txt_files
-    ], ignore_index=True)
-
-    combined_df.drop(columns=[col for col in ['source_file', 'No.'] if col in combined_df.columns], inplace=True)
-    combined_df.insert(0, 'No.', range(1, len(combined_df) + 1))
-
-    if uploaded_lookup_file:
+# Cached separately so a new set of TXT files does not re-parse the same workbook
+@st.cache_data(show_spinner=False, max_entries=4, ttl="1h")
+def load_lookup(lookup_bytes):
+    lookup_df = pd.read_excel(io.BytesIO(lookup_bytes), dtype=str, usecols=['SID', 'Cust ID'], engine='calamine')
+    # A blank SID would otherwise match every transaction that has no SID
+    lookup_df = lookup_df.dropna(subset=['SID']).drop_duplicates(subset='SID', ignore_index=True)
+    return pd.Series(lookup_df['Cust ID'].to_numpy(), index=lookup_df['SID'].astype('string[pyarrow]'))
+
+
+# Cached on the uploaded bytes, so re-processing unchanged files is free. Each
+# entry holds two full DataFrames, so only the most recent batches are kept.
+@st.cache_data(show_spinner=False, max_entries=4, ttl="1h")
+def process_files(txt_files, lookup_bytes):
+    def read_txt(txt_file):
+        name, data = txt_file
+        read_options = pacsv.ReadOptions(use_threads=True)
+        parse_options = pacsv.ParseOptions(delimiter='|')
+        try:
+            try:
+                table = pacsv.read_csv(io.BytesIO(data), read_options=read_options, parse_options=parse_options)
+            except pa.ArrowInvalid:
+                # Arrow rejects rows with missing trailing fields; pandas pads them with NaN
+                df = pd.read_csv(io.BytesIO(data), delimiter='|', encoding='utf-8', dtype_backend='pyarrow')
+                return pa.Table.from_pandas(df, preserve_index=False), None
+
+            # Arrow infers dates, times and timestamps that pandas left as text (and
+            # Excel cannot store tz-aware values). Casting them back would not give the
+            # original text, so such a file runs a second read_csv with those columns
+            # typed as strings, which doubles its parse cost; other files are read once.
+            temporal_cols = {field.name: pa.string() for field in table.schema if pa.types.is_temporal(field.type)}
+            if temporal_cols:
+                table = pacsv.read_csv(
+                    io.BytesIO(data),
+                    read_options=read_options,
+                    parse_options=parse_options,
+                    convert_options=pacsv.ConvertOptions(column_types=temporal_cols)
+                )
+            return table, None
+        except Exception as e:
+            return None, f"{name}: {e}"
+
+    # Parsing releases the GIL, so files are read concurrently. Errors are
+    # collected per file so one bad upload does not abort the others.
+    with ThreadPoolExecutor(max_workers=min(8, len(txt_files))) as executor:
+        results = list(executor.map(read_txt, txt_files))
+    tables = [table for table, _ in results if table is not None]
+    file_errors = [error for _, error in results if error is not None]
+    if not tables:
+        return None, None, file_errors, None
+
+    try:
+        combined_df = pa.concat_tables(tables, promote_options='permissive').to_pandas(types_mapper=pd.ArrowDtype)
+    except pa.ArrowTypeError:
+        # A column was parsed as different types across files; let pandas upcast it
+        combined_df = pd.concat([table.to_pandas(types_mapper=pd.ArrowDtype) for table in tables], ignore_index=True)
+
+    # Row numbers live in a RangeIndex, which is never materialized
+    if 'No.' in combined_df.columns:
+        combined_df.drop(columns=['No.'], inplace=True)
+    combined_df.index = pd.RangeIndex(start=1, stop=len(combined_df) + 1, name='No.')
+
+    # Only a handful of distinct transaction types, so store each one once
+    if 'Transaction Type' in combined_df.columns:
+        combined_df['Transaction Type'] = combined_df['Transaction Type'].astype('category')
+
+    lookup_error = None
+    if lookup_bytes is not None:
         try:
-            lookup_df = pd.read_excel(uploaded_lookup_file, dtype=str).drop_duplicates(subset='SID')
-            combined_df['SID Number'] = combined_df['SID Number'].astype(str)
-            lookup_df['SID'] = lookup_df['SID'].astype(str)
-            combined_df = combined_df.merge(
-                lookup_df[['SID', 'Cust ID']],
-                how='left',
-                left_on='SID Number',
-                right_on='SID',
-                validate='many_to_one'
-            ).drop(columns=['SID'])
+            cust_id_map = load_lookup(lookup_bytes)
+            combined_df['SID Number'] = combined_df['SID Number'].astype('string[pyarrow]')
+            combined_df['Cust ID'] = combined_df['SID Number'].map(cust_id_map)
         except Exception as e:
-            st.error(f"❌ Error reading lookup file: {e}")
+            lookup_error = str(e)
 
     if 'Transaction Type' in combined_df.columns and 'Transaction Date' in combined_df.columns:
-        def build_description(row):
-            ttype = str(row['Transaction Type'])
-            label = 'Subscr' if 'SUBSCR' in ttype.upper() else 'Redemp' if 'REDEMP' in ttype.upper() else ttype[:6]
-            try:
-                date_fmt = pd.to_datetime(str(row['Transaction Date']), format='%Y%m%d')
-                return f"Materai - {label} at {date_fmt.strftime('%d %B %Y')}"
-            except:
-                return f"Materai - {label} at {row['Transaction Date']}"
-        combined_df['Description'] = combined_df.apply(build_description, axis=1)
+        # Many rows share a (type, date) pair, so build each description once
+        # and broadcast it back through the pair's group number
+        keys = ['Transaction Type', 'Transaction Date']
+        pair_codes = combined_df.groupby(keys, sort=False, dropna=False, observed=True).ngroup()
+        pairs = combined_df[keys].drop_duplicates()
+        # astype(str) keeps missing values, which would leave the whole description NaN
+        ttype = pairs['Transaction Type'].astype(str).fillna('')
+        tdate = pairs['Transaction Date'].astype(str).fillna('')
+        label = ttype.str.extract(LABEL_PATTERN, expand=False).str.title().fillna(ttype.str.slice(0, 6))
+        dates = pd.to_datetime(tdate, format='%Y%m%d', errors='coerce')
+        date_str = dates.dt.strftime('%d %B %Y').fillna(tdate)
+        descriptions = ('Materai - ' + label + ' at ' + date_str).to_numpy()
+        combined_df['Description'] = descriptions[pair_codes.to_numpy()]
+
+    # Amounts stay numeric and are formatted by st.dataframe in the browser;
+    # the other columns are shared with combined_df
+    display_df = combined_df.assign(**{
+        col: pd.to_numeric(combined_df[col], errors='coerce')
+        for col in ['Stamp Duty Fee', 'Gross Transaction Amount (IDR Equivalent)']
+        if col in combined_df.columns
+    })
+
+    return display_df, combined_df, file_errors, lookup_error
 
-    def format_number(val):
-        try:
-            val = float(val)
-            return f"{val:,.0f}" if val.is_integer() else f"{val:,.2f}"
-        except:
-            return ""
 
-    display_df = combined_df.copy()
-    for col in ['Stamp Duty Fee', 'Gross Transaction Amount (IDR Equivalent)']:
-        if col in display_df.columns:
-            display_df[col] = pd.to_numeric(display_df[col], errors='coerce').apply(format_number)
+if uploaded_txt_files and process_button:
+    st.info("Processing files... Please wait.")
+
+    display_df, combined_df, file_errors, lookup_error = process_files(
+        tuple((file.name, file.getvalue()) for file in uploaded_txt_files),
+        uploaded_lookup_file.getvalue() if uploaded_lookup_file else None
+    )
+    for file_error in file_errors:
+        st.error(f"❌ Error reading TXT file {file_error}")
+    if lookup_error:
+        st.error(f"❌ Error reading lookup file: {lookup_error}")
 
+    # When nothing parsed, clear the previous batch rather than presenting it as this upload's result
     st.session_state.display_df = display_df
     st.session_state.combined_df = combined_df
-    st.success("✅ Files combined successfully!")
+    if combined_df is not None:
+        st.success("✅ Files combined successfully!")
 
 if st.session_state.display_df is not None:
-    st.dataframe(st.session_state.display_df, use_container_width=True, height=600)
-
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        st.session_state.combined_df.to_excel(writer, index=False, sheet_name='CombinedData')
-        workbook = writer.book
-        worksheet = writer.sheets['CombinedData']
-
-        number_format = workbook.add_format({"num_format": "#,##0.00"})
-        for col_idx, col_name in enumerate(st.session_state.combined_df.columns):
-            if col_name in ['Stamp Duty Fee', 'Gross Transaction Amount (IDR Equivalent)']:
-                worksheet.set_column(col_idx, col_idx, 20, number_format)
-            else:
-                max_len = max(st.session_state.combined_df[col_name].astype(str).map(len).max(), len(str(col_name))) + 2
-                worksheet.set_column(col_idx, col_idx, max_len)
-
-    output.seek(0)
-    st.download_button(
-        label="⬇️ Download Combined Excel File",
-        data=output,
-        file_name="combined_data.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    st.dataframe(
+        st.session_state.display_df,
+        width="stretch",
+        height=600,
+        column_config={
+            col: st.column_config.NumberColumn(format="accounting")
+            for col in ['Stamp Duty Fee', 'Gross Transaction Amount (IDR Equivalent)']
+        }
     )
 
+    combined_df = st.session_state.combined_df
+    # Only the selected format is built; Parquet is far smaller and faster to write
+    download_format = st.radio("Download format", ["Excel (.xlsx)", "Parquet (.parquet)"], horizontal=True)
+
+    if download_format == "Parquet (.parquet)":
+        output = io.BytesIO()
+        # Columns that came out mixed-type from the pd.concat fallback are written as text
+        mixed_cols = combined_df.select_dtypes(include='object').columns
+        combined_df.astype({col: 'string[pyarrow]' for col in mixed_cols}).to_parquet(
+            output, engine='pyarrow', compression='zstd', index=True
+        )
+        st.download_button(
+            label="⬇️ Download Combined Parquet File",
+            data=output.getvalue(),
+            file_name="combined_data.parquet",
+            mime="application/vnd.apache.parquet"
+        )
+    else:
+        output = io.BytesIO()
+        # constant_memory flushes each row as soon as the next one starts, so column
+        # formats are set up front and the data is written strictly row by row
+        # (DataFrame.to_excel writes column by column and would lose cells).
+        with xlsxwriter.Workbook(output, {'constant_memory': True}) as workbook:
+            worksheet = workbook.add_worksheet('CombinedData')
+
+            # Amount columns get a fixed width and number format; every other column is
+            # sized from its widest cell in the first rows, measured natively on the
+            # Arrow string buffers, so this stays O(columns) however long the data is
+            number_format = workbook.add_format({"num_format": "#,##0.00"})
+            width_sample = combined_df.head(1000)
+            worksheet.set_column(0, 0, max(len(str(len(combined_df))), len(combined_df.index.name)) + 2)
+            for col_idx, col_name in enumerate(combined_df.columns, start=1):
+                if col_name in ['Stamp Duty Fee', 'Gross Transaction Amount (IDR Equivalent)']:
+                    worksheet.set_column(col_idx, col_idx, 20, number_format)
+                else:
+                    lengths = pc.utf8_length(pa.array(width_sample[col_name].astype('string[pyarrow]')))
+                    max_len = max(pc.max(lengths).as_py() or 0, len(str(col_name))) + 2
+                    worksheet.set_column(col_idx, col_idx, max_len)
+
+            header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+            worksheet.write_row(0, 0, [combined_df.index.name, *combined_df.columns], header_format)
+            # Convert each column to plain Python values once (missing -> None, a blank cell)
+            # instead of checking every cell while iterating rows; 'No.' comes from the index
+            columns = [combined_df.index] + [
+                combined_df[col_name].to_numpy(dtype=object, na_value=None) for col_name in combined_df.columns
+            ]
+            for row_idx, row in enumerate(zip(*columns), start=1):
+                worksheet.write_row(row_idx, 0, row)
+
+        output.seek(0)
+        st.download_button(
+            label="⬇️ Download Combined Excel File",
+            data=output,
+            file_name="combined_data.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
 elif not uploaded_txt_files:
     st.warning("⚠️ Please upload at least one .txt file to start.")